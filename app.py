@@ -1,20 +1,65 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pacsv
 import io
-from scripts.data_processing import clean_and_convert_data, aggregate_customer_data
+from concurrent.futures import ThreadPoolExecutor
+from scripts.data_processing import clean_and_convert_data, aggregate_customer_data, ORDER_HISTORY_ARROW_TYPES
 from scripts.stratified_sampling import bin_customers, stratified_sample
+from scripts.utils import df_to_csv_bytes
 
 # Configure the Streamlit page
 st.set_page_config(page_title="Direct Mail Campaign Tool", layout="wide")
 st.title("📬 Direct Mail Campaign Sampling Tool")
 
-# Cache heavy processing functions to improve performance
-@st.cache_data
-def process_order_history_cached(df):
-    cleaned_df = clean_and_convert_data(df)
+# Arrow CSV reader options for processing: read only the order history columns
+# (missing ones become nulls) so extra export columns can't break the merge.
+# Blank strings are read as nulls, matching the pandas reader, so cleaning drops them.
+CSV_CONVERT_OPTIONS = pacsv.ConvertOptions(
+    column_types=ORDER_HISTORY_ARROW_TYPES,
+    include_columns=list(ORDER_HISTORY_ARROW_TYPES),
+    include_missing_columns=True,
+    strings_can_be_null=True
+)
+# Upload validation keeps every column so the required-columns check sees the real header
+HEADER_CONVERT_OPTIONS = pacsv.ConvertOptions(
+    column_types=ORDER_HISTORY_ARROW_TYPES,
+    strings_can_be_null=True
+)
+
+# Cache heavy processing keyed on the raw uploaded bytes (cheap to hash, stable across reruns)
+@st.cache_data(show_spinner=False)
+def process_order_history_cached(file_bytes):
+    # Parse files concurrently; Arrow releases the GIL while reading
+    with ThreadPoolExecutor() as executor:
+        tables = list(executor.map(
+            lambda b: pacsv.read_csv(io.BytesIO(b), convert_options=CSV_CONVERT_OPTIONS), file_bytes
+        ))
+    # Concatenate as Arrow tables (no row copies) and convert to pandas once
+    merged_df = pa.concat_tables(tables, promote_options="default").to_pandas(types_mapper=pd.ArrowDtype)
+    cleaned_df = clean_and_convert_data(merged_df)
     customer_summary = aggregate_customer_data(cleaned_df)
     return customer_summary
 
+# Cache CSV encodings of the sampled groups so download buttons don't re-encode on every rerun
+@st.cache_data(show_spinner=False)
+def _group_csv(df, group=None):
+    if group is not None:
+        df = df[df["Group"] == group]
+    return df_to_csv_bytes(df)
+
+# RF proportion matrix from the bucket category codes, buckets in descending order
+def _rf_proportions(df, mask=None):
+    freq_labels = df["Frequency_Bucket"].cat.categories
+    rec_labels = df["Recency_Bucket"].cat.categories
+    nf, nr = len(freq_labels), len(rec_labels)
+    cell = df["Frequency_Bucket"].cat.codes.to_numpy() * nr + df["Recency_Bucket"].cat.codes.to_numpy()
+    if mask is not None:
+        cell = cell[mask]
+    counts = np.bincount(cell, minlength=nf * nr).reshape(nf, nr)
+    return pd.DataFrame(counts / counts.sum(), index=freq_labels, columns=rec_labels).iloc[::-1, ::-1]
+
 # Sidebar: File Upload and Reset Button
 st.sidebar.header("📂 Upload Order History CSVs")
 uploaded_files = st.sidebar.file_uploader(
@@ -25,39 +70,52 @@ if st.sidebar.button("🔄 Reset App"):
     st.session_state.clear()
     st.experimental_rerun()
 
-merged_df = None
+file_bytes = None
+uploaded_columns = set()
 if uploaded_files:
     st.sidebar.success(f"Uploaded {len(uploaded_files)} files.")
-    dataframes = []
+
+    # Open each file to check its header, keeping failures alongside successes
+    results = []
     for file in uploaded_files:
         try:
-            df_temp = pd.read_csv(file)
-            dataframes.append(df_temp)
+            reader = pacsv.open_csv(file, convert_options=HEADER_CONVERT_OPTIONS)
+            results.append((file, reader.schema.names))
         except Exception as e:
+            results.append((file, e))
+
+    valid_files = []
+    for file, result in results:
+        if isinstance(result, Exception):
             st.sidebar.error(f"Error reading file: {file.name}")
-    if dataframes:
-        merged_df = pd.concat(dataframes, ignore_index=True)
-        st.sidebar.info("Files merged successfully! Proceed to processing.")
+        else:
+            valid_files.append(file)
+            uploaded_columns.update(result)
+
+    if valid_files:
+        file_bytes = tuple(file.getvalue() for file in valid_files)
+        st.sidebar.info("Files loaded successfully! Proceed to processing.")
     else:
         st.sidebar.error("No valid CSV files were uploaded.")
 
-# Validate that the merged DataFrame contains the required columns
-if merged_df is not None:
+# Validate that the uploaded files contain the required columns
+if file_bytes is not None:
     required_columns = {"customer_id", "order_id", "day", "customer_email"}
-    if not required_columns.issubset(merged_df.columns):
+    if not required_columns.issubset(uploaded_columns):
         st.error("Uploaded files are missing one or more required columns: customer_id, order_id, day, customer_email.")
-        merged_df = None
+        file_bytes = None
 
 # Process Order History Button
-if merged_df is not None and st.sidebar.button("🚀 Process Order History"):
+if file_bytes is not None and st.sidebar.button("🚀 Process Order History"):
     with st.spinner("Processing order history..."):
-        customer_summary = process_order_history_cached(merged_df)
-        if customer_summary is not None:
+        try:
+            customer_summary = process_order_history_cached(file_bytes)
+        except Exception as e:
+            st.error(f"Error during processing order history: {e}")
+        else:
             st.success("✅ Processing complete! Aggregated customer data is ready.")
             st.dataframe(customer_summary.head(20))
             st.session_state["customer_summary"] = customer_summary
-        else:
-            st.error("Error during processing order history.")
 
 # Recency-Frequency Segmentation Section
 if "customer_summary" in st.session_state:
@@ -78,11 +136,12 @@ if "customer_summary" in st.session_state:
                                   for x in frequency_bins_input.split(",")]
 
                 # Filter out customers above the max recency threshold
-                df_filtered = df[df["recency"] <= max_recency_threshold]
+                mask = df["recency"].to_numpy() <= max_recency_threshold
+                df_filtered = df.iloc[np.flatnonzero(mask)]
                 if df_filtered.empty:
                     st.error("No customers have a recency value below the selected maximum threshold.")
                 else:
-                    df_segmented, segmented_csv = bin_customers(df_filtered.copy(), recency_bins, frequency_bins)
+                    df_segmented, segmented_csv = bin_customers(df_filtered, recency_bins, frequency_bins)
                     if df_segmented.empty:
                         st.error("Segmentation resulted in an empty DataFrame. Please check your bin ranges.")
                     else:
@@ -111,18 +170,7 @@ if "customer_summary" in st.session_state:
     if "segmented_df" in st.session_state:
         df_segmented = st.session_state["segmented_df"]
         st.subheader("📊 Overall RF Segment Proportions")
-        pivot = pd.pivot_table(
-            df_segmented,
-            index="Frequency_Bucket",
-            columns="Recency_Bucket",
-            aggfunc="size",
-            fill_value=0
-        )
-        # Sort Frequency and Recency buckets in descending order
-        freq_order = sorted(pivot.index, key=lambda x: int(x[1:]), reverse=True)
-        rec_order = sorted(pivot.columns, key=lambda x: int(x[1:]), reverse=True)
-        pivot = pivot.reindex(index=freq_order, columns=rec_order)
-        pivot_prop = pivot / pivot.values.sum()
+        pivot_prop = _rf_proportions(df_segmented)
         st.dataframe(pivot_prop.style.format("{:.2%}"))
 
     # Stratified Sampling Section
@@ -140,7 +188,7 @@ if "customer_summary" in st.session_state:
         else:
             sample_sizes = {"Test": test_size, "Control": control_size, "Holdout": holdout_size}
             with st.spinner("Performing stratified sampling..."):
-                sampled_df = stratified_sample(df_segmented.copy(), sample_sizes)
+                sampled_df = stratified_sample(df_segmented, sample_sizes)
                 st.success("✅ Stratified sampling complete!")
                 st.dataframe(sampled_df.head(20))
                 st.session_state["sampled_df"] = sampled_df
@@ -148,21 +196,10 @@ if "customer_summary" in st.session_state:
     # After sampling: Create RF Pivot Matrices for each sample group
     if "sampled_df" in st.session_state:
         sampled_df = st.session_state["sampled_df"]
+        groups = sampled_df["Group"].to_numpy()
         for group in ["Test", "Control", "Holdout"]:
             st.subheader(f"📊 RF Segment Proportions for {group} Group")
-            group_df = sampled_df[sampled_df["Group"] == group]
-            pivot_group = pd.pivot_table(
-                group_df,
-                index="Frequency_Bucket",
-                columns="Recency_Bucket",
-                aggfunc="size",
-                fill_value=0
-            )
-            # Sort descending
-            freq_order_group = sorted(pivot_group.index, key=lambda x: int(x[1:]), reverse=True)
-            rec_order_group = sorted(pivot_group.columns, key=lambda x: int(x[1:]), reverse=True)
-            pivot_group = pivot_group.reindex(index=freq_order_group, columns=rec_order_group)
-            pivot_group_prop = pivot_group / pivot_group.values.sum()
+            pivot_group_prop = _rf_proportions(sampled_df, groups == group)
             st.dataframe(pivot_group_prop.style.format("{:.2%}"))
 
     # Download Buttons for Sample Groups
@@ -170,22 +207,15 @@ if "customer_summary" in st.session_state:
         st.subheader("📥 Download Sampled Groups")
         sampled_df = st.session_state["sampled_df"]
         for group in ["Test", "Control", "Holdout"]:
-            group_df = sampled_df[sampled_df["Group"] == group]
-            csv_buffer = io.StringIO()
-            group_df.to_csv(csv_buffer, index=False)
-            csv_data = csv_buffer.getvalue()
             st.download_button(
                 label=f"📥 Download {group} Group",
-                data=csv_data,
+                data=_group_csv(sampled_df, group),
                 file_name=f"{group}_Group.csv",
                 mime="text/csv"
             )
-        combined_csv_buffer = io.StringIO()
-        sampled_df.to_csv(combined_csv_buffer, index=False)
-        combined_csv_data = combined_csv_buffer.getvalue()
         st.download_button(
             label="📥 Download Combined Sample Group",
-            data=combined_csv_data,
+            data=_group_csv(sampled_df),
             file_name="Combined_Sample_Group.csv",
             mime="text/csv"
         )
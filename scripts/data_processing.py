@@ -1,6 +1,9 @@
 import pandas as pd
+import numpy as np
+import pyarrow as pa
 import os
 import glob
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 # Define file paths
@@ -9,6 +12,28 @@ PROCESSED_DATA_DIR = "data/processed"
 MERGED_FILE_PATH = os.path.join(PROCESSED_DATA_DIR, "merged_order_history.csv")
 CUSTOMER_SUMMARY_PATH = os.path.join(PROCESSED_DATA_DIR, "customer_summary.csv")
 
+# Explicit column types for order history exports (skips per-column type inference)
+ORDER_HISTORY_DTYPES = {
+    "customer_id": "string[pyarrow]",
+    "order_id": "string[pyarrow]",
+    "customer_email": "string[pyarrow]",
+    "gross_sales": "float32",
+    "discounts": "float32",
+    "net_sales": "float32",
+}
+
+# Same schema for the Arrow CSV reader used on uploads; 'day' stays a string so
+# unparseable dates become NaT in clean_and_convert_data instead of failing the read
+ORDER_HISTORY_ARROW_TYPES = {
+    "customer_id": pa.string(),
+    "order_id": pa.string(),
+    "customer_email": pa.string(),
+    "day": pa.string(),
+    "gross_sales": pa.float32(),
+    "discounts": pa.float32(),
+    "net_sales": pa.float32(),
+}
+
 def merge_order_history():
     """
     Reads and merges multiple CSV files from the raw data directory.
@@ -27,8 +52,12 @@ def merge_order_history():
 
     print(f"🔄 Found {len(all_filenames)} order history files. Merging...")
 
-    # Concatenate all files at once (same as Jupyter Notebook approach)
-    df = pd.concat([pd.read_csv(f, dtype={"customer_id": str, "order_id": str}) for f in all_filenames], ignore_index=True)
+    # Parse files concurrently (the C parser releases the GIL), then concatenate all at once
+    with ThreadPoolExecutor() as executor:
+        frames = list(executor.map(
+            lambda f: pd.read_csv(f, dtype=ORDER_HISTORY_DTYPES, parse_dates=["day"]), all_filenames
+        ))
+    df = pd.concat(frames, ignore_index=True)
 
     # Save merged file for inspection
     df.to_csv(MERGED_FILE_PATH, index=False, encoding="utf-8-sig")
@@ -45,22 +74,16 @@ def clean_and_convert_data(df):
     """
     print("🧹 Cleaning data...")
 
-    # Convert date column (assumes 'day' is the date field)
-    if 'day' in df.columns:
+    # Convert date column (assumes 'day' is the date field); skip if already parsed on read
+    if 'day' in df.columns and not pd.api.types.is_datetime64_any_dtype(df['day']):
         df['day'] = pd.to_datetime(df['day'], errors='coerce')
 
-    # Ensure identifier columns remain as strings
-    id_cols = ['customer_id', 'order_id']
-    for col in id_cols:
-        if col in df.columns:
-            df[col] = df[col].astype(str)
-
-    # Convert categorical columns
-    if 'customer_email' in df.columns:
-        df['customer_email'] = df['customer_email'].astype(str)
+    # Ensure identifier and email columns are Arrow-backed strings (a no-op if read that way)
+    str_cols = ['customer_id', 'order_id', 'customer_email']
+    df = df.astype({col: 'string[pyarrow]' for col in str_cols if col in df.columns})
 
-    # Drop rows with missing essential data
-    df.dropna(subset=['customer_id', 'customer_email', 'order_id'], inplace=True)
+    # Drop rows with missing essential data (null or blank strings)
+    df = df.loc[df[str_cols].fillna("").ne("").all(axis=1).to_numpy(dtype=bool)]
 
     print(f"✅ Data cleaned. Total rows after cleaning: {len(df)}")
     return df
@@ -80,7 +103,9 @@ def aggregate_customer_data(df, current_date=None):
     if current_date is None:
         current_date = datetime.today()
 
-    customer_summary = df.groupby(['customer_id', 'customer_email'], observed=True).agg(
+    # Group on customer_id alone so email variants don't split a customer; skip the key sort
+    customer_summary = df.groupby('customer_id', sort=False, observed=True).agg(
+        customer_email=('customer_email', 'first'),  # First email seen for the customer
         frequency=('order_id', 'nunique'),  # Number of unique orders
         last_order_date=('day', 'max'),     # Most recent order date
         gross_sales=('gross_sales', 'sum'), # Total gross sales
@@ -88,17 +113,25 @@ def aggregate_customer_data(df, current_date=None):
         net_sales=('net_sales', 'sum')      # Total net sales
     ).reset_index()
 
-    # Compute Recency in months
-    customer_summary['recency'] = (
-        (current_date.year - customer_summary['last_order_date'].dt.year) * 12 +
-        (current_date.month - customer_summary['last_order_date'].dt.month)
-    )
-
-    # Drop customers who are missing emails AFTER aggregation
-    customer_summary.dropna(subset=['customer_email'], inplace=True)
-
-    # Ensure `customer_id` is stored as a string 
-    customer_summary['customer_id'] = customer_summary['customer_id'].astype(str)
+    # Drop customers who are missing emails (or any valid order date) AFTER aggregation
+    customer_summary.dropna(subset=['customer_email', 'last_order_date'], inplace=True)
+
+    # Compute Recency in months as a single month-resolution subtraction
+    last = customer_summary['last_order_date'].to_numpy("datetime64[ns]")
+    cur = np.datetime64(current_date, "M")
+    customer_summary['recency'] = (cur - last.astype("datetime64[M]")).astype("int16")
+
+    # Store identifiers as Arrow-backed strings and downcast numeric columns
+    # to keep session state and serialization small
+    customer_summary = customer_summary.astype({
+        'customer_id': 'string[pyarrow]',
+        'customer_email': 'string[pyarrow]',
+        'frequency': 'int32',
+        'recency': 'int16',
+        'gross_sales': 'float32',
+        'discounts': 'float32',
+        'net_sales': 'float32',
+    })
 
     # Save processed file with explicit formatting to avoid scientific notation in Excel
     customer_summary.to_csv(CUSTOMER_SUMMARY_PATH, index=False, encoding="utf-8-sig", float_format="%.2f")
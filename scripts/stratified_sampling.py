@@ -1,7 +1,7 @@
 import pandas as pd
 import numpy as np
 import os
-import io
+from scripts.utils import df_to_csv_bytes
 
 # Define default parameters
 DEFAULT_RECENCY_BINS = [0, 1, 2, 3, 4, 5, 6, 7, 13, 25, 37]  # Months
@@ -16,6 +16,30 @@ DEFAULT_SAMPLE_SIZES = {
 RANDOM_SEED = 42
 
 
+def _bucket_codes(values, bins):
+    """
+    Assigns each value to a left-closed [a, b) bin with one binary search over the sorted edges.
+
+    Args:
+    - values (np.ndarray): Values to bin.
+    - bins (list): Sorted bin edges.
+
+    Returns:
+    - codes (np.ndarray): Bin index per value, or -1 if the value falls outside the bins.
+
+    Raises:
+    - ValueError: If the bin edges are not strictly increasing.
+    """
+    bins = np.asarray(bins, dtype="float64")
+    if np.any(np.diff(bins) <= 0):
+        raise ValueError("Bin edges must be unique and increase monotonically.")
+    # side="right" gives bins[i] <= value < bins[i + 1]; values below the first edge land on -1
+    codes = np.searchsorted(bins, values, side="right") - 1
+    # Values at or above the last edge (and NaN, which sorts last) are out of range
+    codes[codes >= len(bins) - 1] = -1
+    return codes
+
+
 def bin_customers(df, recency_bins=None, frequency_bins=None):
     """
     Categorizes customers into Recency and Frequency bins and prepares a downloadable CSV buffer.
@@ -26,8 +50,8 @@ def bin_customers(df, recency_bins=None, frequency_bins=None):
     - frequency_bins (list): Custom bin edges for frequency segmentation.
 
     Returns:
-    - df (pd.DataFrame): Updated DataFrame with RF segment labels.
-    - csv_buffer (io.StringIO): Buffer containing CSV data for download.
+    - df (pd.DataFrame): Binned customers with RF segment labels (the input is not modified).
+    - csv_data (bytes): CSV data for download.
     """
     recency_bins = recency_bins or DEFAULT_RECENCY_BINS
     frequency_bins = frequency_bins or DEFAULT_FREQUENCY_BINS
@@ -36,20 +60,24 @@ def bin_customers(df, recency_bins=None, frequency_bins=None):
     recency_labels = [f"R{i}" for i in range(1, len(recency_bins))]
     frequency_labels = [f"F{i}" for i in range(1, len(frequency_bins))]
 
-    # Apply binning
-    df["Recency_Bucket"] = pd.cut(df["recency"], bins=recency_bins, labels=recency_labels, right=False)
-    df["Frequency_Bucket"] = pd.cut(df["frequency"], bins=frequency_bins, labels=frequency_labels, right=False)
-
-    # Drop rows with NaN buckets (customers who don't fit into bins)
-    df.dropna(subset=["Recency_Bucket", "Frequency_Bucket"], inplace=True)
-
-    # Create combined RF segment
-    df["Segment"] = df["Frequency_Bucket"].astype(str) + "_" + df["Recency_Bucket"].astype(str)
-
-    # Create a CSV buffer for download
-    csv_buffer = io.StringIO()
-    df.to_csv(csv_buffer, index=False)
-    csv_data = csv_buffer.getvalue()
+    # Apply binning (codes of -1 mark customers outside the bin range)
+    ri = _bucket_codes(df["recency"].to_numpy(), recency_bins)
+    fi = _bucket_codes(df["frequency"].to_numpy(), frequency_bins)
+    valid = (ri >= 0) & (fi >= 0)
+    ri, fi = ri[valid], fi[valid]
+
+    # Drop customers who don't fit into bins and attach the new columns on the result,
+    # leaving the caller's frame untouched. Buckets are ordered categoricals so their
+    # order follows the bin edges; Segment is built from the bucket codes.
+    segment_labels = [f"{f}_{r}" for f in frequency_labels for r in recency_labels]
+    df = df[valid].assign(
+        Recency_Bucket=pd.Categorical.from_codes(ri, categories=recency_labels, ordered=True),
+        Frequency_Bucket=pd.Categorical.from_codes(fi, categories=frequency_labels, ordered=True),
+        Segment=pd.Categorical.from_codes(fi * len(recency_labels) + ri, categories=segment_labels)
+    )
+
+    # Encode the binned data as CSV for download
+    csv_data = df_to_csv_bytes(df)
 
     return df, csv_data
 
@@ -67,47 +95,50 @@ def stratified_sample(df, sample_sizes=None, seed=RANDOM_SEED):
     - combined_df (pd.DataFrame): Final dataset with assigned groups.
     """
     sample_sizes = sample_sizes or DEFAULT_SAMPLE_SIZES
-    np.random.seed(seed)
-
-    # Initialize empty DataFrames for each group
-    test_group, control_group, holdout_group = pd.DataFrame(), pd.DataFrame(), pd.DataFrame()
-
-    # Calculate segment proportions
-    segment_counts = df["Segment"].value_counts()
-    segment_proportions = segment_counts / segment_counts.sum()
-
-    # Stratified sampling within each segment
-    for segment, proportion in segment_proportions.items():
-        segment_data = df[df["Segment"] == segment]
-
-        # Compute sample sizes per segment
-        n_test = int(round(sample_sizes["Test"] * proportion))
-        n_control = int(round(sample_sizes["Control"] * proportion))
-        n_holdout = int(round(sample_sizes["Holdout"] * proportion))
-
-        # Shuffle before sampling
-        segment_data = segment_data.sample(frac=1, random_state=seed).reset_index(drop=True)
-
-        # Adjust sample sizes if segment is too small
-        total_needed = n_test + n_control + n_holdout
-        if len(segment_data) < total_needed:
-            scaling_factor = len(segment_data) / total_needed
-            n_test = int(round(n_test * scaling_factor))
-            n_control = int(round(n_control * scaling_factor))
-            n_holdout = len(segment_data) - n_test - n_control  # Ensure all customers are assigned
-
-        # Assign groups
-        test_group = pd.concat([test_group, segment_data.iloc[:n_test]], ignore_index=True)
-        control_group = pd.concat([control_group, segment_data.iloc[n_test:n_test + n_control]], ignore_index=True)
-        holdout_group = pd.concat([holdout_group, segment_data.iloc[n_test + n_control:n_test + n_control + n_holdout]], ignore_index=True)
-
-    # Label groups
-    test_group["Group"] = "Test"
-    control_group["Group"] = "Control"
-    holdout_group["Group"] = "Holdout"
-
-    # Combine datasets
-    combined_df = pd.concat([test_group, control_group, holdout_group], ignore_index=True)
+    rng = np.random.default_rng(seed)
+
+    # Segment code and size for every row, from a single groupby pass
+    seg = df.groupby("Segment", observed=True, sort=False).ngroup().to_numpy()
+    counts = np.bincount(seg)
+    proportions = counts / counts.sum()
+
+    # Compute sample sizes per segment
+    n_test = np.round(sample_sizes["Test"] * proportions).astype(np.int64)
+    n_control = np.round(sample_sizes["Control"] * proportions).astype(np.int64)
+    n_holdout = np.round(sample_sizes["Holdout"] * proportions).astype(np.int64)
+
+    # Adjust sample sizes if segment is too small
+    total_needed = n_test + n_control + n_holdout
+    too_small = counts < total_needed
+    scaling_factor = np.divide(counts, total_needed, out=np.ones(len(counts)), where=too_small)
+    n_test = np.where(too_small, np.round(n_test * scaling_factor), n_test).astype(np.int64)
+    n_control = np.where(too_small, np.round(n_control * scaling_factor), n_control).astype(np.int64)
+    n_holdout = np.where(too_small, counts - n_test - n_control, n_holdout)  # Ensure all customers are assigned
+
+    # Shuffle within segments: order rows by segment, then by a random key,
+    # so each row's rank within its segment is its offset from the segment start
+    order = np.lexsort((rng.random(len(seg)), seg))
+    order_seg = seg[order]
+    rank = np.arange(len(order)) - (np.cumsum(counts) - counts)[order_seg]
+
+    # Assign groups by comparing each rank against its segment's cutoffs
+    test_cut = n_test[order_seg]
+    control_cut = test_cut + n_control[order_seg]
+    holdout_cut = control_cut + n_holdout[order_seg]
+    test_idx = order[rank < test_cut]
+    control_idx = order[(rank >= test_cut) & (rank < control_cut)]
+    holdout_idx = order[(rank >= control_cut) & (rank < holdout_cut)]
+
+    # Select all sampled rows with one take and label them by group
+    group_labels = np.repeat(
+        np.array(["Test", "Control", "Holdout"], dtype=object),
+        [len(test_idx), len(control_idx), len(holdout_idx)]
+    )
+    combined_df = (
+        df.iloc[np.concatenate([test_idx, control_idx, holdout_idx])]
+        .reset_index(drop=True)
+        .assign(Group=group_labels)
+    )
 
     return combined_df
 
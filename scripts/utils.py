@@ -0,0 +1,14 @@
+def df_to_csv_bytes(df):
+    """
+    Serializes a DataFrame to CSV bytes for download buttons.
+
+    Uses DataFrame.to_csv so dates without a time of day are written as
+    'YYYY-MM-DD' and strings are only quoted when needed, which Excel reads cleanly.
+
+    Args:
+    - df (pd.DataFrame): Data to serialize (the index is not written).
+
+    Returns:
+    - csv_bytes (bytes): UTF-8 encoded CSV data.
+    """
+    return df.to_csv(index=False).encode("utf-8")
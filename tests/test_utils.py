@@ -0,0 +1,22 @@
+import pandas as pd
+
+from scripts.utils import df_to_csv_bytes
+
+
+def test_df_to_csv_bytes_matches_to_csv_download_format():
+    df = pd.DataFrame({
+        "customer_id": pd.array(["1001", "1002"], dtype="string[pyarrow]"),
+        "customer_email": ["a@x.com", "b,c@x.com"],
+        "last_order_date": pd.to_datetime(["2024-01-05", "2024-04-30"]),
+        "net_sales": [47.0, 18.1],
+        "Recency_Bucket": pd.Categorical(["R1", "R2"], ordered=True),
+    })
+
+    expected = (
+        "customer_id,customer_email,last_order_date,net_sales,Recency_Bucket\n"
+        "1001,a@x.com,2024-01-05,47.0,R1\n"
+        '1002,"b,c@x.com",2024-04-30,18.1,R2\n'
+    )
+
+    assert df_to_csv_bytes(df) == expected.encode("utf-8")
+    assert df_to_csv_bytes(df) == df.to_csv(index=False).encode("utf-8")